@@ -4,8 +4,30 @@ from multiprocessing import cpu_count
 
 class Settings(BaseSettings):
     ws_connection_limit: int = 1000
+    ws_debounce_window: float = 0.05
+    ws_cancel_limit: int = 10
     worker_limit: int = cpu_count() - 1
     task_timeout: int = 5
+    connect_four_columns: int = 7
+    connect_four_rows: int = 6
+    shared_tt_size: int = 1 << 20
+    shared_tt_name: str = "minimax_algorithm_tt"
+    shared_tt_min_depth: int = 6
+    overload_queue_length: int = 8
+    overload_latency: float = 2.5
+    reject_queue_length: int = 64
+    latency_smoothing: float = 0.2
+    degraded_depth_limit: int = 4
+    result_cache_size: int = 10000
+    ponder: bool = True
+    batch_position_limit: int = 100
+    batch_job_limit: int = 1000
+    mcts_time_limit: float = 3
+    mcts_playout_limit: int = 1000000
+    mcts_playout_batch: int = 8
+    admin_token: str = None
+    profile_dir: str = "profiles"
+    profile_interval: float = 0.005
 
 
 settings = Settings()
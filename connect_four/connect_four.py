@@ -1,10 +1,72 @@
 from functools import cache
 from math import inf
+from config import settings
+from connect_four import transposition_table
+
+
+# geometry
+#
+# Every column takes rows + 1 bits, bit column * height + row holds the
+# token in (column, row) and the extra bit on top of every column stays
+# empty, so patterns can't wrap from one column into the next.
+# Everything the hot path needs is derived once, at import time.
+
+columns = settings.connect_four_columns
+rows = settings.connect_four_rows
+height = rows + 1
+
+v_shift = 1
+h_shift = height
+d1_shift = height + 1
+d2_shift = height - 1
+v_shift2 = 2 * v_shift
+h_shift2 = 2 * h_shift
+d1_shift2 = 2 * d1_shift
+d2_shift2 = 2 * d2_shift
+
+board_mask = 0
+top_mask = 0
+bottom_mask = 0
+column_masks = []
+move_table = []
+for column_index in range(columns):
+    column_mask = ((1 << rows) - 1) << column_index * height
+    board_mask |= column_mask
+    top_mask |= 1 << (column_index * height + rows - 1)
+    bottom_mask |= 1 << column_index * height
+    column_masks.append(column_mask)
+    move_table.append((1 << (column_index * height + rows - 1),
+                       column_mask,
+                       1 << column_index * height))
+column_masks = tuple(column_masks)
+move_table = tuple(move_table)
+threat_shifts = tuple((shift, 2 * shift, 3 * shift)
+                      for shift in (h_shift, d1_shift, d2_shift))
+del column_index, column_mask
+
+
+def pair_starts(shift: int):
+    return board_mask & (board_mask >> shift)
+
+
+def window_starts(shift: int):
+    return pair_starts(shift) & (pair_starts(shift) >> 2 * shift)
+
+
+v_pairs = pair_starts(v_shift)
+v_windows = window_starts(v_shift)
+h_pairs = pair_starts(h_shift)
+h_windows = window_starts(h_shift)
+d1_pairs = pair_starts(d1_shift)
+d1_windows = window_starts(d1_shift)
+d2_pairs = pair_starts(d2_shift)
+d2_windows = window_starts(d2_shift)
 
 
 # minimax
 
 @cache
+@transposition_table.shared(1, False, False)
 def minimax(yellow_tokens: int,
             token_mask: int,
             maximizer_turn: bool):
@@ -14,9 +76,16 @@ def minimax(yellow_tokens: int,
             red_tokens, token_mask)
         if is_final_state:
             return -u, 1
+        if winning_cells(yellow_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return 1, 1
+        moves = non_losing_moves(
+            token_mask, winning_cells(red_tokens, token_mask))
+        if not moves:
+            return -1, 1
         v = -inf
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_yellow_tokens = yellow_tokens | move
             successor_mask = token_mask | move
             res_eval, res_nodes = minimax(
@@ -29,9 +98,17 @@ def minimax(yellow_tokens: int,
             yellow_tokens, token_mask)
         if is_final_state:
             return u, 1
+        red_tokens = ~yellow_tokens & token_mask
+        if winning_cells(red_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return -1, 1
+        moves = non_losing_moves(
+            token_mask, winning_cells(yellow_tokens, token_mask))
+        if not moves:
+            return 1, 1
         v = inf
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_mask = token_mask | move
             res_eval, res_nodes = minimax(
                 yellow_tokens, successor_mask, True)
@@ -43,6 +120,7 @@ def minimax(yellow_tokens: int,
 # minimax_alpha_beta
 
 @cache
+@transposition_table.shared(2, False, True)
 def minimax_alpha_beta(yellow_tokens: int,
                        token_mask: int,
                        maximizer_turn: bool,
@@ -53,8 +131,15 @@ def minimax_alpha_beta(yellow_tokens: int,
             red_tokens, token_mask)
         if is_final_state:
             return -u, 1
+        if winning_cells(yellow_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return 1, 1
+        moves = non_losing_moves(
+            token_mask, winning_cells(red_tokens, token_mask))
+        if not moves:
+            return -1, 1
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_yellow_tokens = yellow_tokens | move
             successor_token_mask = token_mask | move
             res_eval, res_nodes = minimax_alpha_beta(
@@ -70,8 +155,16 @@ def minimax_alpha_beta(yellow_tokens: int,
             yellow_tokens, token_mask)
         if is_final_state:
             return u, 1
+        red_tokens = ~yellow_tokens & token_mask
+        if winning_cells(red_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return -1, 1
+        moves = non_losing_moves(
+            token_mask, winning_cells(yellow_tokens, token_mask))
+        if not moves:
+            return 1, 1
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_token_mask = token_mask | move
             res_eval, res_nodes = minimax_alpha_beta(
                 yellow_tokens, successor_token_mask,
@@ -86,6 +179,7 @@ def minimax_alpha_beta(yellow_tokens: int,
 # depth_limited_minimax
 
 @cache
+@transposition_table.shared(3, True, False)
 def depth_limited_minimax(yellow_tokens: int,
                           token_mask: int, d: int,
                           maximizer_turn: bool):
@@ -95,9 +189,18 @@ def depth_limited_minimax(yellow_tokens: int,
             red_tokens, token_mask, d)
         if d == 0 or is_final_state:
             return -h, 1
+        if winning_cells(yellow_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return 1, 1
+        moves = playable_cells(token_mask)
+        if d >= 2:
+            moves = non_losing_moves(
+                token_mask, winning_cells(red_tokens, token_mask))
+            if not moves:
+                return -1, 1
         v = -inf
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_yellow_tokens = yellow_tokens | move
             successor_mask = token_mask | move
             res_eval, res_nodes = depth_limited_minimax(
@@ -111,9 +214,19 @@ def depth_limited_minimax(yellow_tokens: int,
             yellow_tokens, token_mask, d)
         if d == 0 or is_final_state:
             return h, 1
+        red_tokens = ~yellow_tokens & token_mask
+        if winning_cells(red_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return -1, 1
+        moves = playable_cells(token_mask)
+        if d >= 2:
+            moves = non_losing_moves(
+                token_mask, winning_cells(yellow_tokens, token_mask))
+            if not moves:
+                return 1, 1
         v = inf
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_mask = token_mask | move
             res_eval, res_nodes = depth_limited_minimax(
                 yellow_tokens, successor_mask,
@@ -126,6 +239,7 @@ def depth_limited_minimax(yellow_tokens: int,
 # depth_limited_minimax_alpha_beta
 
 @cache
+@transposition_table.shared(4, True, True)
 def depth_limited_minimax_alpha_beta(yellow_tokens: int,
                                      token_mask: int, d: int,
                                      maximizer_turn: bool,
@@ -136,8 +250,17 @@ def depth_limited_minimax_alpha_beta(yellow_tokens: int,
             red_tokens, token_mask, d)
         if d == 0 or is_final_state:
             return -h, 1
+        if winning_cells(yellow_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return 1, 1
+        moves = playable_cells(token_mask)
+        if d >= 2:
+            moves = non_losing_moves(
+                token_mask, winning_cells(red_tokens, token_mask))
+            if not moves:
+                return -1, 1
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_yellow_tokens = yellow_tokens | move
             successor_token_mask = token_mask | move
             res_eval, res_nodes \
@@ -155,8 +278,18 @@ def depth_limited_minimax_alpha_beta(yellow_tokens: int,
             yellow_tokens, token_mask, d)
         if d == 0 or is_final_state:
             return h, 1
+        red_tokens = ~yellow_tokens & token_mask
+        if winning_cells(red_tokens, token_mask) \
+                & playable_cells(token_mask):
+            return -1, 1
+        moves = playable_cells(token_mask)
+        if d >= 2:
+            moves = non_losing_moves(
+                token_mask, winning_cells(yellow_tokens, token_mask))
+            if not moves:
+                return 1, 1
         evaluated_nodes = 0
-        for move in possible_moves(token_mask):
+        for move in column_moves(moves):
             successor_token_mask = token_mask | move
             res_eval, res_nodes \
                 = depth_limited_minimax_alpha_beta(
@@ -170,23 +303,25 @@ def depth_limited_minimax_alpha_beta(yellow_tokens: int,
         return beta, evaluated_nodes + 1
 
 
+# Heuristic values are multiples of 0.02, root moves searched with a
+# depth limit share an aspiration window of +-aspiration_delta.
+aspiration_delta = 0.05
+
+
 def heuristic(tokens: int, token_mask: int, d: int):
-    pattern_mask = tokens & (tokens >> 6)
-    if pattern_mask & (pattern_mask >> 12):
+    pattern_mask = tokens & (tokens >> d2_shift)
+    if pattern_mask & (pattern_mask >> d2_shift2):
         return True, 1
-    pattern_mask = tokens & (tokens >> 7)
-    if pattern_mask & (pattern_mask >> 14):
+    pattern_mask = tokens & (tokens >> h_shift)
+    if pattern_mask & (pattern_mask >> h_shift2):
         return True, 1
-    pattern_mask = tokens & (tokens >> 8)
-    if pattern_mask & (pattern_mask >> 16):
+    pattern_mask = tokens & (tokens >> d1_shift)
+    if pattern_mask & (pattern_mask >> d1_shift2):
         return True, 1
-    pattern_mask = tokens & (tokens >> 1)
-    if pattern_mask & (pattern_mask >> 2):
+    pattern_mask = tokens & (tokens >> v_shift)
+    if pattern_mask & (pattern_mask >> v_shift2):
         return True, 1
-    pattern_mask = 1
-    for index in range(7):
-        pattern_mask &= token_mask >> index * 7 + 5
-    if pattern_mask == 1:
+    if token_mask & top_mask == top_mask:
         return True, 0
     if d != 0:
         return False, None
@@ -194,124 +329,158 @@ def heuristic(tokens: int, token_mask: int, d: int):
     not_tokens = ~tokens
     opponent_tokens = ~tokens & token_mask
     not_opponent_tokens = ~opponent_tokens
-    buffer = not_opponent_tokens & (not_opponent_tokens >> 1)
-    buffer_vertical = buffer & (buffer >> 2)
-    buffer = not_opponent_tokens & (not_opponent_tokens >> 7)
-    buffer_horizontal = buffer & (buffer >> 14)
-    buffer = not_opponent_tokens & (not_opponent_tokens >> 8)
-    buffer_diagonal1 = buffer & (buffer >> 16)
-    buffer = not_opponent_tokens & (not_opponent_tokens >> 6)
-    buffer_diagonal2 = buffer & (buffer >> 12)
-    buffer = not_tokens & (not_tokens >> 1)
-    opponent_buffer_vertical = buffer & (buffer >> 2)
-    buffer = not_tokens & (not_tokens >> 7)
-    opponent_buffer_horizontal = buffer & (buffer >> 14)
-    buffer = not_tokens & (not_tokens >> 8)
-    opponent_buffer_diagonal1 = buffer & (buffer >> 16)
-    buffer = not_tokens & (not_tokens >> 6)
-    opponent_buffer_diagonal2 = buffer & (buffer >> 12)
-    pattern_mask = (tokens | (tokens >> 1)) & 137412980756383
-    pattern_mask &= (pattern_mask >> 2)
+    buffer = not_opponent_tokens & (not_opponent_tokens >> v_shift)
+    buffer_vertical = buffer & (buffer >> v_shift2)
+    buffer = not_opponent_tokens & (not_opponent_tokens >> h_shift)
+    buffer_horizontal = buffer & (buffer >> h_shift2)
+    buffer = not_opponent_tokens & (not_opponent_tokens >> d1_shift)
+    buffer_diagonal1 = buffer & (buffer >> d1_shift2)
+    buffer = not_opponent_tokens & (not_opponent_tokens >> d2_shift)
+    buffer_diagonal2 = buffer & (buffer >> d2_shift2)
+    buffer = not_tokens & (not_tokens >> v_shift)
+    opponent_buffer_vertical = buffer & (buffer >> v_shift2)
+    buffer = not_tokens & (not_tokens >> h_shift)
+    opponent_buffer_horizontal = buffer & (buffer >> h_shift2)
+    buffer = not_tokens & (not_tokens >> d1_shift)
+    opponent_buffer_diagonal1 = buffer & (buffer >> d1_shift2)
+    buffer = not_tokens & (not_tokens >> d2_shift)
+    opponent_buffer_diagonal2 = buffer & (buffer >> d2_shift2)
+    pattern_mask = (tokens | (tokens >> v_shift)) & v_pairs
+    pattern_mask &= (pattern_mask >> v_shift2)
     pattern_mask &= buffer_vertical
     h += bin(pattern_mask).count('1')
-    pattern_mask = tokens & (tokens >> 1)
-    pattern_mask |= (pattern_mask >> 2)
-    pattern_mask &= 31028737590151
+    pattern_mask = tokens & (tokens >> v_shift)
+    pattern_mask |= (pattern_mask >> v_shift2)
+    pattern_mask &= v_windows
     pattern_mask &= buffer_vertical
     h += bin(pattern_mask).count('1')
-    pattern_mask = (tokens | (tokens >> 7)) & 2181708111807
-    pattern_mask &= (pattern_mask >> 14)
+    pattern_mask = (tokens | (tokens >> h_shift)) & h_pairs
+    pattern_mask &= (pattern_mask >> h_shift2)
     pattern_mask &= buffer_horizontal
     h += bin(pattern_mask).count('1')
-    pattern_mask = tokens & (tokens >> 7)
-    pattern_mask |= (pattern_mask >> 14)
-    pattern_mask &= 133160895
+    pattern_mask = tokens & (tokens >> h_shift)
+    pattern_mask |= (pattern_mask >> h_shift2)
+    pattern_mask &= h_windows
     pattern_mask &= buffer_horizontal
     h += bin(pattern_mask).count('1')
-    pattern_mask = (tokens | (tokens >> 8)) & 1073538912159
-    pattern_mask &= (pattern_mask >> 16)
+    pattern_mask = (tokens | (tokens >> d1_shift)) & d1_pairs
+    pattern_mask &= (pattern_mask >> d1_shift2)
     pattern_mask &= buffer_diagonal1
     h += bin(pattern_mask).count('1')
-    pattern_mask = tokens & (tokens >> 8)
-    pattern_mask |= (pattern_mask >> 16)
-    pattern_mask &= 14795655
+    pattern_mask = tokens & (tokens >> d1_shift)
+    pattern_mask |= (pattern_mask >> d1_shift2)
+    pattern_mask &= d1_windows
     pattern_mask &= buffer_diagonal1
     h += bin(pattern_mask).count('1')
-    pattern_mask = (tokens | (tokens >> 6)) & 2147077824318
-    pattern_mask &= (pattern_mask >> 12)
+    pattern_mask = (tokens | (tokens >> d2_shift)) & d2_pairs
+    pattern_mask &= (pattern_mask >> d2_shift2)
     pattern_mask &= buffer_diagonal2
     h += bin(pattern_mask).count('1')
-    pattern_mask = tokens & (tokens >> 6)
-    pattern_mask |= (pattern_mask >> 12)
-    pattern_mask &= 118365240
+    pattern_mask = tokens & (tokens >> d2_shift)
+    pattern_mask |= (pattern_mask >> d2_shift2)
+    pattern_mask &= d2_windows
     pattern_mask &= buffer_diagonal2
     h += bin(pattern_mask).count('1')
-    pattern_mask = (opponent_tokens | (opponent_tokens >> 1)) \
-        & 137412980756383
-    pattern_mask &= (pattern_mask >> 2)
+    pattern_mask = (opponent_tokens | (opponent_tokens >> v_shift)) \
+        & v_pairs
+    pattern_mask &= (pattern_mask >> v_shift2)
     pattern_mask &= opponent_buffer_vertical
     h -= bin(pattern_mask).count('1')
-    pattern_mask = opponent_tokens & (opponent_tokens >> 1)
-    pattern_mask |= (pattern_mask >> 2)
-    pattern_mask &= 31028737590151
+    pattern_mask = opponent_tokens & (opponent_tokens >> v_shift)
+    pattern_mask |= (pattern_mask >> v_shift2)
+    pattern_mask &= v_windows
     pattern_mask &= opponent_buffer_vertical
     h -= bin(pattern_mask).count('1')
-    pattern_mask = (opponent_tokens | (opponent_tokens >> 7)) \
-        & 2181708111807
-    pattern_mask &= (pattern_mask >> 14)
+    pattern_mask = (opponent_tokens | (opponent_tokens >> h_shift)) \
+        & h_pairs
+    pattern_mask &= (pattern_mask >> h_shift2)
     pattern_mask &= opponent_buffer_horizontal
     h -= bin(pattern_mask).count('1')
-    pattern_mask = opponent_tokens & (opponent_tokens >> 7)
-    pattern_mask |= (pattern_mask >> 14)
-    pattern_mask &= 133160895
+    pattern_mask = opponent_tokens & (opponent_tokens >> h_shift)
+    pattern_mask |= (pattern_mask >> h_shift2)
+    pattern_mask &= h_windows
     pattern_mask &= opponent_buffer_horizontal
     h -= bin(pattern_mask).count('1')
-    pattern_mask = (opponent_tokens | (opponent_tokens >> 8)) \
-        & 1073538912159
-    pattern_mask &= (pattern_mask >> 16)
+    pattern_mask = (opponent_tokens | (opponent_tokens >> d1_shift)) \
+        & d1_pairs
+    pattern_mask &= (pattern_mask >> d1_shift2)
     pattern_mask &= opponent_buffer_diagonal1
     h -= bin(pattern_mask).count('1')
-    pattern_mask = opponent_tokens & (opponent_tokens >> 8)
-    pattern_mask |= (pattern_mask >> 16)
-    pattern_mask &= 14795655
+    pattern_mask = opponent_tokens & (opponent_tokens >> d1_shift)
+    pattern_mask |= (pattern_mask >> d1_shift2)
+    pattern_mask &= d1_windows
     pattern_mask &= opponent_buffer_diagonal1
     h -= bin(pattern_mask).count('1')
-    pattern_mask = (opponent_tokens | (opponent_tokens >> 6)) \
-        & 2147077824318
-    pattern_mask &= (pattern_mask >> 12)
+    pattern_mask = (opponent_tokens | (opponent_tokens >> d2_shift)) \
+        & d2_pairs
+    pattern_mask &= (pattern_mask >> d2_shift2)
     pattern_mask &= opponent_buffer_diagonal2
     h -= bin(pattern_mask).count('1')
-    pattern_mask = opponent_tokens & (opponent_tokens >> 6)
-    pattern_mask |= (pattern_mask >> 12)
-    pattern_mask &= 118365240
+    pattern_mask = opponent_tokens & (opponent_tokens >> d2_shift)
+    pattern_mask |= (pattern_mask >> d2_shift2)
+    pattern_mask &= d2_windows
     pattern_mask &= opponent_buffer_diagonal2
     h -= bin(pattern_mask).count('1')
     return False, h * 0.02
 
 
 def utility(tokens: int, token_mask: int):
-    pattern_mask = tokens & (tokens >> 6)
-    if pattern_mask & (pattern_mask >> 12):
+    pattern_mask = tokens & (tokens >> d2_shift)
+    if pattern_mask & (pattern_mask >> d2_shift2):
         return True, 1
-    pattern_mask = tokens & (tokens >> 7)
-    if pattern_mask & (pattern_mask >> 14):
+    pattern_mask = tokens & (tokens >> h_shift)
+    if pattern_mask & (pattern_mask >> h_shift2):
         return True, 1
-    pattern_mask = tokens & (tokens >> 8)
-    if pattern_mask & (pattern_mask >> 16):
+    pattern_mask = tokens & (tokens >> d1_shift)
+    if pattern_mask & (pattern_mask >> d1_shift2):
         return True, 1
-    pattern_mask = tokens & (tokens >> 1)
-    if pattern_mask & (pattern_mask >> 2):
+    pattern_mask = tokens & (tokens >> v_shift)
+    if pattern_mask & (pattern_mask >> v_shift2):
         return True, 1
-    pattern_mask = 1
-    for index in range(7):
-        pattern_mask &= token_mask >> index * 7 + 5
-    if pattern_mask == 1:
+    if token_mask & top_mask == top_mask:
         return True, 0
     return False, None
 
 
 def possible_moves(token_mask: int):
-    for index in range(7):
-        if (token_mask >> index * 7 + 5) & 1 == 0:
-            yield ((((1 << 6) - 1) << index * 7) & token_mask) \
-                + (1 << index * 7)
+    for top, column_mask, bottom in move_table:
+        if not token_mask & top:
+            yield (token_mask & column_mask) + bottom
+
+
+def playable_cells(token_mask: int):
+    return (token_mask + bottom_mask) & board_mask
+
+
+def winning_cells(tokens: int, token_mask: int):
+    # empty cells that would complete four in a row for tokens
+    cells = (tokens << v_shift) & (tokens << v_shift2) \
+        & (tokens << 3 * v_shift)
+    for shift, shift2, shift3 in threat_shifts:
+        pattern_mask = (tokens << shift) & (tokens << shift2)
+        cells |= pattern_mask & (tokens << shift3)
+        cells |= pattern_mask & (tokens >> shift)
+        pattern_mask = (tokens >> shift) & (tokens >> shift2)
+        cells |= pattern_mask & (tokens << shift)
+        cells |= pattern_mask & (tokens >> shift3)
+    return cells & board_mask & ~token_mask
+
+
+def non_losing_moves(token_mask: int, opponent_winning_cells: int):
+    # Moves that don't hand the opponent an immediate win. With an
+    # opponent win playable, blocking it is the only candidate, and
+    # with two of them every move loses. All the other moves lose one
+    # ply later, so skipping them doesn't change any value.
+    moves = playable_cells(token_mask)
+    forced_moves = moves & opponent_winning_cells
+    if forced_moves:
+        if forced_moves & (forced_moves - 1):
+            return 0
+        moves = forced_moves
+    return moves & ~(opponent_winning_cells >> v_shift)
+
+
+def column_moves(moves: int):
+    for column_mask in column_masks:
+        if moves & column_mask:
+            yield moves & column_mask
@@ -0,0 +1,150 @@
+from math import log, sqrt
+from random import Random
+from timeit import default_timer
+from connect_four import connect_four
+
+
+exploration = sqrt(2)
+
+
+class Node:
+    __slots__ = ("yellow_tokens", "token_mask", "yellow_turn",
+                 "terminal_value", "proven_value", "untried_moves",
+                 "children", "visits", "value_sum")
+
+    def __init__(self, yellow_tokens: int, token_mask: int,
+                 yellow_turn: bool, terminal_value):
+        self.yellow_tokens = yellow_tokens
+        self.token_mask = token_mask
+        self.yellow_turn = yellow_turn
+        # value of a final state from yellow's perspective, else None
+        self.terminal_value = terminal_value
+        # game theoretic value once it is known, selection doesn't
+        # spend playouts on solved nodes
+        self.proven_value = terminal_value
+        self.untried_moves = [] if terminal_value is not None \
+            else list(connect_four.possible_moves(token_mask))
+        self.children = []
+        self.visits = 0
+        self.value_sum = 0
+
+    def child(self, move: int):
+        if self.yellow_turn:
+            yellow_tokens = self.yellow_tokens | move
+            tokens = yellow_tokens
+        else:
+            yellow_tokens = self.yellow_tokens
+            tokens = ~yellow_tokens & (self.token_mask | move)
+        is_final_state, u = connect_four.utility(
+            tokens, self.token_mask | move)
+        terminal_value = None
+        if is_final_state:
+            terminal_value = u if self.yellow_turn else -u
+        return Node(yellow_tokens, self.token_mask | move,
+                    not self.yellow_turn, terminal_value)
+
+    def select_child(self):
+        log_visits = log(self.visits)
+        best_child = None
+        best_score = None
+        for child in self.children:
+            if child.proven_value is not None:
+                continue
+            mean = child.value_sum / child.visits
+            if not self.yellow_turn:
+                mean = -mean
+            score = mean + exploration * sqrt(log_visits / child.visits)
+            if best_score is None or score > best_score:
+                best_child = child
+                best_score = score
+        return best_child
+
+    def update_proven_value(self):
+        # a node is won as soon as one move wins, otherwise its value
+        # is known once the values of all moves are
+        values = [child.proven_value for child in self.children]
+        win = 1 if self.yellow_turn else -1
+        if win in values:
+            self.proven_value = win
+        elif not self.untried_moves and None not in values:
+            self.proven_value = max(values) if self.yellow_turn \
+                else min(values)
+
+    def undecided(self):
+        return self.untried_moves or any(
+            child.proven_value is None for child in self.children)
+
+
+def playout(yellow_tokens: int, token_mask: int, yellow_turn: bool,
+            rng: Random):
+    while True:
+        move = rng.choice(list(connect_four.possible_moves(token_mask)))
+        token_mask |= move
+        if yellow_turn:
+            yellow_tokens |= move
+            is_final_state, u = connect_four.utility(
+                yellow_tokens, token_mask)
+            if is_final_state:
+                return u
+        else:
+            is_final_state, u = connect_four.utility(
+                ~yellow_tokens & token_mask, token_mask)
+            if is_final_state:
+                return -u
+        yellow_turn = not yellow_turn
+
+
+def mcts(yellow_tokens: int, token_mask: int, yellow_turn: bool,
+         time_limit: float, playout_limit: int, playout_batch: int):
+    start_time = default_timer()
+    rng = Random()
+    root = Node(yellow_tokens, token_mask, yellow_turn, None)
+    if not root.untried_moves:
+        # full board, there is nothing to evaluate
+        return [], 0
+    playouts = 0
+    # root moves stay searched until every one of them is solved, so a
+    # winning move doesn't take the budget of the others
+    while playouts < playout_limit \
+            and default_timer() - start_time < time_limit \
+            and root.undecided():
+        # selection
+        node = root
+        path = [node]
+        while not node.untried_moves and node.children:
+            node = node.select_child()
+            path.append(node)
+        # expansion
+        if node.untried_moves:
+            node = node.child(node.untried_moves.pop())
+            path[-1].children.append(node)
+            path.append(node)
+        # simulation, a batch of playouts per leaf amortizes the cost
+        # of walking the tree
+        if node.terminal_value is not None:
+            # solved, its parents get a proof instead of playouts
+            for node in reversed(path[:-1]):
+                node.update_proven_value()
+                if node.proven_value is None:
+                    break
+            continue
+        value_sum = 0
+        for _ in range(playout_batch):
+            value_sum += playout(node.yellow_tokens, node.token_mask,
+                                 node.yellow_turn, rng)
+        playouts += playout_batch
+        # backpropagation
+        for node in path:
+            node.visits += playout_batch
+            node.value_sum += value_sum
+
+    # evaluations in the order of possible_moves, as the proven value or
+    # else the mean playout result of every root move from yellow's
+    # perspective
+    values = {child.token_mask: child.proven_value
+              if child.proven_value is not None
+              else child.value_sum / child.visits
+              for child in root.children}
+    evaluations = [values.get(token_mask | move, 0)
+                   for move in connect_four.possible_moves(token_mask)]
+    return evaluations, playouts
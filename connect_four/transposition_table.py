@@ -0,0 +1,225 @@
+from functools import wraps
+from multiprocessing import shared_memory
+from os import path
+from struct import Struct
+from time import sleep
+from zlib import crc32
+from config import settings
+
+
+# Fixed-size transposition table in shared memory, read and written by
+# every Connect Four worker process without locks.
+#
+# An entry takes four 64-bit words: check, value, nodes and meta, with
+# check = key ^ value ^ nodes ^ meta. An entry torn by two processes
+# writing it at the same time no longer matches its key and reads as a
+# miss. Entries come in buckets of two, a store overwrites the entry of
+# the same position, else the one with less remaining depth.
+#
+# meta bits: 0-2 search function, 3 maximizer_turn, 4-11 depth limit,
+# 12-13 bound type, 14+ remaining depth
+#
+# The first bucket is a header describing the table. A process attaching
+# to an existing segment checks it, so a segment left behind by a crash,
+# by an older version of the search or by a server with another board
+# size or table size is never read as if it were current.
+
+entry_words = 4
+header_words = 2 * entry_words
+ident_mask = (1 << 12) - 1
+word_mask = (1 << 64) - 1
+double = Struct("d")
+word = Struct("Q")
+
+exact = 0
+lower_bound = 1
+upper_bound = 2
+
+cells = settings.connect_four_columns * settings.connect_four_rows
+# position keys are token_mask + yellow_tokens, which must fit a word,
+# a column adds at most 2 ** (rows + 1) - 2, so 64 bits of board fit
+enabled = settings.shared_tt_size > 0 \
+    and settings.connect_four_columns \
+    * (settings.connect_four_rows + 1) <= 64
+
+memory = None
+created = False
+words = None
+buckets = 0
+hits = 0
+
+
+def fingerprint():
+    # changes with the search functions, the heuristic and the entry
+    # format, which all decide what a stored value means
+    directory = path.dirname(path.abspath(__file__))
+    checksum = 0
+    for file_name in ("connect_four.py", "transposition_table.py"):
+        with open(path.join(directory, file_name), "rb") as file:
+            checksum = crc32(file.read(), checksum)
+    return checksum
+
+
+def header():
+    return (0x7474, fingerprint(), settings.connect_four_columns,
+            settings.connect_four_rows, settings.shared_tt_size,
+            entry_words)
+
+
+def create_segment():
+    global memory, created, words
+    memory = shared_memory.SharedMemory(
+        name=settings.shared_tt_name, create=True,
+        size=(header_words + settings.shared_tt_size * entry_words) * 8)
+    created = True
+    words = memory.buf.cast("Q")
+    for index, value in enumerate(header()):
+        words[index] = value
+
+
+def attach_segment():
+    global memory, words
+    memory = shared_memory.SharedMemory(name=settings.shared_tt_name)
+    words = memory.buf.cast("Q")
+    expected = header()
+    # a server that just created the segment may still be writing it
+    if len(words) < header_words:
+        return False
+    for _ in range(10):
+        if words[0]:
+            break
+        sleep(0.05)
+    return tuple(words[:len(expected)]) == expected
+
+
+def close_segment():
+    global memory, words
+    if words is not None:
+        words.release()
+        words = None
+    if memory is not None:
+        memory.close()
+        memory = None
+
+
+def create():
+    global memory, created, words, buckets
+    if not enabled:
+        return
+    try:
+        create_segment()
+    except FileExistsError:
+        # another server process on this host already created it
+        if not attach_segment():
+            # left behind or made for another configuration, start
+            # over with a segment of our own
+            print("Shared transposition table doesn't match, "
+                  "recreating it")
+            memory.unlink()
+            close_segment()
+            try:
+                create_segment()
+            except FileExistsError:
+                print("Shared transposition table disabled")
+                close_segment()
+                return
+    buckets = (len(words) - header_words) // (2 * entry_words)
+
+
+def destroy():
+    global created
+    if memory is None:
+        return
+    if created:
+        try:
+            memory.unlink()
+        except FileNotFoundError:
+            # a server with another configuration recreated it
+            pass
+    close_segment()
+    created = False
+
+
+def probe(key: int, ident: int):
+    index = header_words + hash((key, ident)) % buckets * 2 * entry_words
+    for index in (index, index + entry_words):
+        meta = words[index + 3]
+        if meta & ident_mask != ident:
+            continue
+        value_bits = words[index + 1]
+        nodes = words[index + 2]
+        if words[index] ^ value_bits ^ nodes ^ meta == key:
+            return double.unpack(word.pack(value_bits))[0], nodes, \
+                meta >> 12 & 3
+    return None
+
+
+def store(key: int, ident: int, bound: int, remaining: int,
+          value: float, nodes: int):
+    index = header_words + hash((key, ident)) % buckets * 2 * entry_words
+    replace_index = index
+    if words[index + 3] >> 14 > words[index + entry_words + 3] >> 14:
+        replace_index = index + entry_words
+    for index in (index, index + entry_words):
+        meta = words[index + 3]
+        if meta & ident_mask == ident and words[index] ^ words[index + 1] \
+                ^ words[index + 2] ^ meta == key:
+            replace_index = index
+            break
+    value_bits = word.unpack(double.pack(value))[0]
+    nodes = min(nodes, word_mask)
+    meta = ident | bound << 12 | remaining << 14
+    words[replace_index + 1] = value_bits
+    words[replace_index + 2] = nodes
+    words[replace_index + 3] = meta
+    words[replace_index] = key ^ value_bits ^ nodes ^ meta
+
+
+def shared(tag: int, depth_limited: bool, alpha_beta: bool):
+    # Decorator placed between @cache and a search function, with
+    # arguments (yellow_tokens, token_mask, [d,] maximizer_turn,
+    # [alpha, beta]). Only nodes with at least shared_tt_min_depth
+    # plies left go to the table, the process-local cache is cheaper
+    # for the rest.
+    def decorator(func):
+        if not enabled:
+            return func
+
+        @wraps(func)
+        def search(*args):
+            global hits
+            if words is None:
+                return func(*args)
+            if depth_limited:
+                d = args[2]
+                remaining = d
+                maximizer_turn = args[3]
+            else:
+                d = 0
+                remaining = cells - bin(args[1]).count("1")
+                maximizer_turn = args[2]
+            if remaining < settings.shared_tt_min_depth:
+                return func(*args)
+            key = args[1] + args[0]
+            ident = tag | maximizer_turn << 3 | d << 4
+            entry = probe(key, ident)
+            if entry is not None:
+                value, nodes, bound = entry
+                if bound == exact \
+                        or bound == lower_bound and value >= args[-1] \
+                        or bound == upper_bound and value <= args[-2]:
+                    hits += 1
+                    return value, nodes
+            result = func(*args)
+            bound = exact
+            if alpha_beta:
+                if result[0] >= args[-1]:
+                    bound = lower_bound
+                elif result[0] <= args[-2]:
+                    bound = upper_bound
+            store(key, ident, bound, remaining, result[0], result[1])
+            return result
+
+        return search
+
+    return decorator
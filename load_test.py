@@ -0,0 +1,234 @@
+from argparse import ArgumentParser
+from asyncio import gather, run, sleep, wait_for, TimeoutError
+from json import dumps, loads
+from os import environ
+from random import Random
+from socket import create_connection
+from subprocess import Popen
+from sys import executable
+from time import sleep as blocking_sleep
+from timeit import default_timer
+from websockets import connect
+from websockets.exceptions import ConnectionClosed
+
+
+def random_tic_tac_toe_board(rng: Random):
+    board = ['_'] * 9
+    for move_index in range(rng.randint(0, 4)):
+        empty_tiles = [index for index, tile in enumerate(board)
+                       if tile == '_']
+        board[rng.choice(empty_tiles)] = 'x' if move_index % 2 == 0 \
+            else 'o'
+    return "".join(board)
+
+
+def random_connect_four_board(rng: Random, args):
+    columns = [""] * args.connect_four_columns
+    for move_index in range(rng.randint(6, 16)):
+        open_columns = [index for index, column in enumerate(columns)
+                        if len(column) < args.connect_four_rows]
+        columns[rng.choice(open_columns)] += 'y' if move_index % 2 == 0 \
+            else 'r'
+    return ",".join(columns)
+
+
+def random_message(rng: Random, args):
+    if rng.random() < args.connect_four_ratio:
+        return {"type": "connect_four",
+                "board": random_connect_four_board(rng, args),
+                "alpha_beta_pruning": rng.random() < 0.5,
+                "depth_limit": True,
+                "depth_limit_value": args.depth_limit}
+    return {"type": "tic_tac_toe",
+            "board": random_tic_tac_toe_board(rng),
+            "alpha_beta_pruning": rng.random() < 0.5,
+            "depth_limit": False,
+            "depth_limit_value": None}
+
+
+async def drain(ws, quiet_time: float):
+    # responses to a cancelled or re-sent request can still arrive after
+    # it is over, they are discarded here so the next request on this
+    # connection doesn't take them for its own
+    while True:
+        try:
+            await wait_for(ws.recv(), quiet_time)
+        except TimeoutError:
+            return
+
+
+async def run_request(ws, message: dict, interrupt: str,
+                      interrupt_after: float, quiet_time: float,
+                      results: dict):
+    sent_time = default_timer()
+    running_time = None
+    resent = False
+    deadline = sent_time + interrupt_after if interrupt else None
+    await ws.send(dumps(message))
+    while True:
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - default_timer(), 0)
+        try:
+            data = loads(await wait_for(ws.recv(), timeout))
+        except TimeoutError:
+            if interrupt == "cancel":
+                await ws.send(dumps({"type": "cancel_task"}))
+                results["cancelled"] += 1
+                await drain(ws, quiet_time)
+                return
+            # re-send, the server keeps evaluating the identical
+            # message, so the request keeps its original timings
+            await ws.send(dumps(message))
+            results["resent"] += 1
+            resent = True
+            deadline = None
+            continue
+        if data["status"] == "running" and running_time is None:
+            running_time = default_timer()
+        elif data["status"] == "complete":
+            complete_time = default_timer()
+            if running_time is not None:
+                results["queue_wait"].append(running_time - sent_time)
+            results["latency"].append(complete_time - sent_time)
+            if "degraded" in data:
+                results["degraded"] += 1
+            break
+        elif data["status"] == "timeout":
+            results["timeouts"] += 1
+            break
+        elif data["status"] == "rejected":
+            results["rejected"] += 1
+            break
+    if resent:
+        # a re-send that crossed the final response starts a new task,
+        # whose responses must not leak into the next request
+        await drain(ws, quiet_time)
+
+
+async def run_client(url: str, client_index: int, args, results: dict):
+    rng = Random(args.seed + client_index)
+    await sleep(rng.random() * args.ramp_up)
+    try:
+        async with connect(url) as ws:
+            for _ in range(args.requests):
+                message = random_message(rng, args)
+                interrupt = None
+                action = rng.random()
+                if action < args.cancel_ratio:
+                    interrupt = "cancel"
+                elif action < args.cancel_ratio + args.resend_ratio:
+                    interrupt = "resend"
+                await run_request(ws, message, interrupt,
+                                  rng.random() * args.interrupt_after,
+                                  args.drain_time, results)
+                await sleep(rng.random() * args.think_time)
+    except ConnectionClosed:
+        results["rejected_connections"] += 1
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def report(results: dict, elapsed_time: float):
+    print(f"Elapsed time: {elapsed_time:.2f} s")
+    print(f"Completed: {len(results['latency'])}")
+    print(f"Throughput: {len(results['latency']) / elapsed_time:.2f} req/s")
+    print(f"Timeouts: {results['timeouts']}")
+    print(f"Cancelled: {results['cancelled']}")
+    print(f"Re-sent: {results['resent']}")
+    print(f"Degraded: {results['degraded']}")
+    print(f"Rejected: {results['rejected']}")
+    print(f"Rejected connections: {results['rejected_connections']}")
+    for key in ["queue_wait", "latency"]:
+        line = f"{key}:"
+        for p in [50, 95, 99]:
+            value = percentile(results[key], p)
+            line += f"  p{p}=" + \
+                ("-" if value is None else f"{value * 1000:.1f} ms")
+        print(line)
+
+
+def start_app(args):
+    env = dict(environ)
+    if args.worker_limit is not None:
+        env["WORKER_LIMIT"] = str(args.worker_limit)
+    if args.ws_connection_limit is not None:
+        env["WS_CONNECTION_LIMIT"] = str(args.ws_connection_limit)
+    if args.task_timeout is not None:
+        env["TASK_TIMEOUT"] = str(args.task_timeout)
+    env["CONNECT_FOUR_COLUMNS"] = str(args.connect_four_columns)
+    env["CONNECT_FOUR_ROWS"] = str(args.connect_four_rows)
+    app = Popen([executable, "-m", "uvicorn", "main:app",
+                 "--port", str(args.port), "--log-level", "warning"],
+                env=env)
+    for _ in range(100):
+        try:
+            create_connection(("127.0.0.1", args.port)).close()
+            return app
+        except OSError:
+            if app.poll() is not None:
+                break
+            blocking_sleep(0.1)
+    app.terminate()
+    raise RuntimeError("app failed to start")
+
+
+async def main(args):
+    results = {"queue_wait": [], "latency": [], "timeouts": 0,
+               "cancelled": 0, "resent": 0, "degraded": 0, "rejected": 0,
+               "rejected_connections": 0}
+    start_time = default_timer()
+    await gather(*[run_client(args.url, client_index, args, results)
+                   for client_index in range(args.clients)])
+    report(results, default_timer() - start_time)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Replay a mix of tic-tac-toe and Connect Four "
+                    "requests against /ws with N concurrent clients.")
+    parser.add_argument("--url", default=None,
+                        help="target an already running app instead of "
+                             "starting one locally")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=10,
+                        help="requests per client")
+    parser.add_argument("--connect-four-ratio", type=float, default=0.5)
+    parser.add_argument("--depth-limit", type=int, default=6,
+                        help="depth_limit_value of Connect Four requests")
+    parser.add_argument("--cancel-ratio", type=float, default=0.1)
+    parser.add_argument("--resend-ratio", type=float, default=0.1)
+    parser.add_argument("--interrupt-after", type=float, default=0.5,
+                        help="max seconds before a cancel or re-send")
+    parser.add_argument("--drain-time", type=float, default=0.2,
+                        help="seconds without a response after which a "
+                             "cancelled request is considered drained")
+    parser.add_argument("--think-time", type=float, default=0.2,
+                        help="max seconds between requests of a client")
+    parser.add_argument("--ramp-up", type=float, default=1.0,
+                        help="max seconds before a client connects")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker-limit", type=int, default=None)
+    parser.add_argument("--ws-connection-limit", type=int, default=None)
+    parser.add_argument("--task-timeout", type=int, default=None)
+    parser.add_argument("--connect-four-columns", type=int, default=7)
+    parser.add_argument("--connect-four-rows", type=int, default=6)
+    args = parser.parse_args()
+
+    app = None
+    if args.url is None:
+        app = start_app(args)
+        args.url = f"ws://127.0.0.1:{args.port}/ws"
+    try:
+        run(main(args))
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait()
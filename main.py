@@ -1,14 +1,24 @@
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, \
-    WebSocketDisconnect, status
+from fastapi import FastAPI, HTTPException, Body, Depends, Header, \
+    WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from asyncio import Event, get_event_loop, wait_for, CancelledError
+from asyncio import Event, get_event_loop, wait_for, sleep, \
+    CancelledError, current_task
 from multiprocessing.pool import Pool
+from collections import OrderedDict
 from json import loads
 from math import inf
+from os import listdir, path
+from secrets import compare_digest
 from timeit import default_timer
+from uuid import uuid4
 from config import settings
+from search_stats import SearchStats, tic_tac_toe_ply, connect_four_ply, \
+    mnk_ply
+import profiler
+import root_search
 from tic_tac_toe import tic_tac_toe
-from connect_four import connect_four
+from connect_four import connect_four, mcts, transposition_table
+from mnk import mnk
 
 
 app = FastAPI()
@@ -25,7 +35,25 @@ app.add_middleware(
 
 curr_ws_connections = 0
 curr_workers = 0
+ponder_workers = 0
 curr_workers_change = Event()
+profiled_tasks = 0
+batch_jobs = OrderedDict()
+result_cache = OrderedDict()
+ponder_tasks = {}
+waiting_tasks = 0
+latency = 0
+
+
+@app.on_event("startup")
+def create_transposition_table():
+    # created before any worker is forked, so all of them share it
+    transposition_table.create()
+
+
+@app.on_event("shutdown")
+def destroy_transposition_table():
+    transposition_table.destroy()
 
 
 def validate_tic_tac_toe_board(board: str):
@@ -48,19 +76,62 @@ def validate_tic_tac_toe_board(board: str):
     return board
 
 
+def validate_mnk_board(board: str, m: int, n: int, k: int):
+    validate_mnk_geometry(m, n, k)
+    if len(board) != m * n:
+        raise HTTPException(
+            status_code=400,
+            detail="len(board) != m * n")
+    for tile in board:
+        if tile not in ['x', 'o', '_']:
+            raise HTTPException(
+                status_code=400,
+                detail="tile not in ['x', 'o', '_']")
+    x_count = board.count('x')
+    o_count = board.count('o')
+    if x_count != o_count and x_count != o_count + 1:
+        raise HTTPException(
+            status_code=400,
+            detail="x_count != o_count and x_count != o_count + 1")
+    return board, m, n, k
+
+
+def validate_mnk_geometry(m: int, n: int, k: int):
+    if not (m >= 3 and m <= 19 and n >= 3 and n <= 19):
+        raise HTTPException(
+            status_code=400,
+            detail="m and n can't be smaller than 3 or greater than 19")
+    if not (k >= 3 and k <= max(m, n)):
+        raise HTTPException(
+            status_code=400,
+            detail="k can't be smaller than 3 or greater than max(m, n)")
+    return m, n, k
+
+
+def encode_mnk_board(board: str):
+    x_tokens = 0
+    o_tokens = 0
+    for tile_index, tile in enumerate(board):
+        if tile == 'x':
+            x_tokens |= mnk.cell_bit(tile_index)
+        elif tile == 'o':
+            o_tokens |= mnk.cell_bit(tile_index)
+    return x_tokens, o_tokens
+
+
 def validate_connect_four_board(board: str):
     columns = board.split(",")
-    if len(columns) != 7:
+    if len(columns) != connect_four.columns:
         raise HTTPException(
             status_code=400,
-            detail="len(columns) != 7")
+            detail=f"len(columns) != {connect_four.columns}")
     y_count = 0
     r_count = 0
     for column in columns:
-        if len(column) > 6:
+        if len(column) > connect_four.rows:
             raise HTTPException(
                 status_code=400,
-                detail="len(column) > 6")
+                detail=f"len(column) > {connect_four.rows}")
         for token in column:
             if token == 'y':
                 y_count += 1
@@ -84,11 +155,11 @@ def encode_connect_four_board(board: str):
     for column_index, column in enumerate(columns):
         for token_index, token in enumerate(column):
             if token == 'y':
-                yellow_tokens |= 1 << (column_index * 7
+                yellow_tokens |= 1 << (column_index * connect_four.height
                                        + token_index)
                 token_mask |= yellow_tokens
             elif token == 'r':
-                token_mask |= 1 << (column_index * 7
+                token_mask |= 1 << (column_index * connect_four.height
                                     + token_index)
     return yellow_tokens, token_mask
 
@@ -111,23 +182,353 @@ def validate_depth_limit(depth_limit: bool = False,
     return depth_limit_value
 
 
+def validate_mcts_budget(time_limit: float = None,
+                         playout_limit: int = None):
+    if time_limit is None:
+        time_limit = settings.mcts_time_limit
+    if playout_limit is None:
+        playout_limit = settings.mcts_playout_limit
+    if not (time_limit > 0 and time_limit < settings.task_timeout):
+        raise HTTPException(
+            status_code=400,
+            detail="time_limit can't be smaller than or equal to 0 \
+                or greater than or equal to task_timeout")
+    if not playout_limit >= 1:
+        raise HTTPException(
+            status_code=400,
+            detail="playout_limit can't be smaller than 1")
+    return time_limit, playout_limit
+
+
+def validate_batch_analysis(data: dict = Body(...)):
+    if data.get("type") not in ["tic_tac_toe", "connect_four", "mnk"]:
+        raise HTTPException(
+            status_code=400,
+            detail="type not in ['tic_tac_toe', 'connect_four', 'mnk']")
+    if ("boards" in data) == ("moves" in data):
+        raise HTTPException(
+            status_code=400,
+            detail="exactly one of boards and moves is required")
+    if "moves" in data and not (
+            isinstance(data["moves"], list)
+            and all(isinstance(move, int) for move in data["moves"])):
+        raise HTTPException(
+            status_code=400,
+            detail="moves must be a list of integers")
+    if "boards" in data and not (
+            isinstance(data["boards"], list)
+            and all(isinstance(board, str) for board in data["boards"])):
+        raise HTTPException(
+            status_code=400,
+            detail="boards must be a list of strings")
+    if data["type"] == "mnk":
+        for field in ["m", "n", "k"]:
+            if not isinstance(data.get(field), int):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{field} must be an integer")
+    if not isinstance(data.get("stats", False), bool):
+        raise HTTPException(
+            status_code=400,
+            detail="stats must be a boolean")
+    algorithm = data.get("algorithm", "minimax")
+    if algorithm == "mcts" and data["type"] == "connect_four":
+        if data.get("stats", False):
+            raise HTTPException(
+                status_code=400,
+                detail="stats aren't available for algorithm 'mcts'")
+        validate_mcts_budget(data.get("time_limit"),
+                             data.get("playout_limit"))
+    elif algorithm == "minimax":
+        for field in ["alpha_beta_pruning", "depth_limit"]:
+            if not isinstance(data.get(field), bool):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{field} must be a boolean")
+        if data.get("depth_limit_value") is not None \
+                and not isinstance(data["depth_limit_value"], int):
+            raise HTTPException(
+                status_code=400,
+                detail="depth_limit_value must be an integer")
+        validate_depth_limit(data["depth_limit"],
+                             data.get("depth_limit_value"))
+        data = dict(data, depth_limit_value=data.get("depth_limit_value"))
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail=f"algorithm '{algorithm}' isn't supported for "
+                   f"{data['type']}")
+    if "moves" in data:
+        boards = replay_moves(data)
+    else:
+        boards = data["boards"]
+    if not (len(boards) >= 1
+            and len(boards) <= settings.batch_position_limit):
+        raise HTTPException(
+            status_code=400,
+            detail=f"len(boards) can't be smaller than 1 \
+                or greater than {settings.batch_position_limit}")
+    messages = []
+    for board in boards:
+        message = dict(data, board=board)
+        message.pop("boards", None)
+        message.pop("moves", None)
+        # fail fast in the event loop instead of inside the job
+        if data["type"] == "tic_tac_toe":
+            validate_tic_tac_toe_board(board)
+        elif data["type"] == "connect_four":
+            validate_connect_four_board(board)
+        else:
+            validate_mnk_board(board, data["m"], data["n"], data["k"])
+        messages.append(message)
+    return messages
+
+
+def replay_moves(data: dict):
+    if data["type"] == "connect_four":
+        columns = [""] * connect_four.columns
+        boards = [",".join(columns)]
+        for move_index, move in enumerate(data["moves"]):
+            if not (0 <= move < connect_four.columns
+                    and len(columns[move]) < connect_four.rows):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"moves[{move_index}] is not a legal move")
+            columns[move] += 'y' if move_index % 2 == 0 else 'r'
+            boards.append(",".join(columns))
+        return boards
+    if data["type"] == "tic_tac_toe":
+        tiles = ['_'] * 9
+    else:
+        m, n, _ = validate_mnk_geometry(data["m"], data["n"], data["k"])
+        tiles = ['_'] * (m * n)
+    boards = ["".join(tiles)]
+    for move_index, move in enumerate(data["moves"]):
+        if not (0 <= move < len(tiles) and tiles[move] == '_'):
+            raise HTTPException(
+                status_code=400,
+                detail=f"moves[{move_index}] is not a legal move")
+        tiles[move] = 'x' if move_index % 2 == 0 else 'o'
+        boards.append("".join(tiles))
+    return boards
+
+
+def validate_admin_token(x_admin_token: str = Header(None)):
+    if settings.admin_token is None or x_admin_token is None \
+            or not compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(
+            status_code=403,
+            detail="x_admin_token is invalid")
+
+
+def result_cache_key(data: dict):
+    if data.get("stats", False) \
+            or data.get("algorithm", "minimax") != "minimax":
+        return None
+    depth_limit_value = None
+    if data.get("depth_limit"):
+        depth_limit_value = data.get("depth_limit_value")
+    return (data["type"], data["board"], data.get("alpha_beta_pruning"),
+            data.get("depth_limit"), depth_limit_value,
+            data.get("m"), data.get("n"), data.get("k"))
+
+
+def store_result(key: tuple, result: tuple, low_priority: bool = False):
+    if key is None:
+        return
+    result_cache[key] = result[:2]
+    # low priority results are the first ones to be evicted
+    result_cache.move_to_end(key, last=not low_priority)
+    while len(result_cache) > settings.result_cache_size:
+        result_cache.popitem(last=False)
+
+
+def child_boards(data: dict):
+    board = data["board"]
+    if data["type"] == "connect_four":
+        columns = board.split(",")
+        token = 'y' if board.count('y') == board.count('r') else 'r'
+        for column_index, column in enumerate(columns):
+            if len(column) < connect_four.rows:
+                yield ",".join(columns[:column_index]
+                               + [column + token]
+                               + columns[column_index + 1:])
+    else:
+        tile = 'x' if board.count('x') == board.count('o') else 'o'
+        for tile_index, curr_tile in enumerate(board):
+            if curr_tile == '_':
+                yield board[:tile_index] + tile + board[tile_index + 1:]
+
+
+def schedule_ponder(ws, func, data: dict):
+    if not settings.ponder or result_cache_key(data) is None:
+        return
+    if id(ws) in ponder_tasks:
+        ponder_tasks.pop(id(ws)).cancel()
+    messages = []
+    for board in child_boards(data):
+        message = dict(data, board=board)
+        if result_cache_key(message) not in result_cache:
+            messages.append(message)
+    if messages and curr_workers < settings.worker_limit:
+        ponder_tasks[id(ws)] = get_event_loop().create_task(
+            ponder(ws, func, messages))
+
+
+async def ponder(ws, func, messages: list):
+    global curr_workers, ponder_workers
+
+    # only idle capacity is used, and apply_async_task cancels
+    # ponder tasks as soon as a real request has to wait for a worker
+    if not curr_workers < settings.worker_limit:
+        if ponder_tasks.get(id(ws)) is current_task():
+            ponder_tasks.pop(id(ws))
+        return
+
+    curr_workers_change.clear()
+    curr_workers += 1
+    ponder_workers += 1
+
+    pool = Pool(1)
+    loop = get_event_loop()
+    futures = []
+    for message in messages:
+        future = loop.create_future()
+
+        def future_set_result(result, future=future):
+            loop.call_soon_threadsafe(future.set_result, result)
+        pool.apply_async(func, (message,), callback=future_set_result)
+        futures.append(future)
+
+    try:
+        for message, future in zip(messages, futures):
+            result = await wait_for(
+                future, timeout=settings.task_timeout)
+            store_result(result_cache_key(message), result,
+                         low_priority=True)
+
+        pool.close()
+
+    except (CancelledError, TimeoutError):
+        pool.terminate()
+
+    finally:
+        curr_workers -= 1
+        ponder_workers -= 1
+        curr_workers_change.set()
+        if ponder_tasks.get(id(ws)) is current_task():
+            ponder_tasks.pop(id(ws))
+
+
+def overloaded():
+    # recent latency only counts while no worker is free for a real
+    # request, so an idle server recovers without waiting for the
+    # average to decay. Pondering workers count as free, they are
+    # preempted before a request waits.
+    return waiting_tasks >= settings.overload_queue_length \
+        or (latency >= settings.overload_latency
+            and not curr_workers - ponder_workers < settings.worker_limit)
+
+
+def retry_after():
+    # time until the tasks already waiting get a worker
+    return round(max(latency, 1) * (waiting_tasks + 1)
+                 / max(settings.worker_limit, 1), 1)
+
+
+def observe_latency(elapsed_time: float):
+    global latency
+    latency += settings.latency_smoothing * (elapsed_time - latency)
+
+
+def degrade(data: dict):
+    # cheaper settings for the same request: alpha-beta pruning yields
+    # the same evaluations as plain minimax, a depth limit doesn't
+    degraded = {}
+    if data.get("algorithm", "minimax") != "minimax":
+        return data, None
+    if not data["alpha_beta_pruning"]:
+        degraded["alpha_beta_pruning"] = True
+    if data["type"] in ["connect_four", "mnk"]:
+        if not data["depth_limit"] \
+                or data["depth_limit_value"] \
+                > settings.degraded_depth_limit:
+            degraded["depth_limit"] = True
+            degraded["depth_limit_value"] = settings.degraded_depth_limit
+    if not degraded:
+        return data, None
+    return dict(data, **degraded), degraded
+
+
 async def apply_async_task(ws, func, *args):
-    global curr_workers
+    global curr_workers, profiled_tasks, waiting_tasks
 
-    while not curr_workers < settings.worker_limit:
-        await ws.send_json({"status": "waiting"})
-        await curr_workers_change.wait()
+    start_time = default_timer()
+    data = args[0]
+    key = result_cache_key(data)
+    if key in result_cache:
+        result_cache.move_to_end(key)
+        evaluations, evaluated_nodes = result_cache[key]
+        await ws.send_json({"status": "complete",
+                            "evaluations": evaluations,
+                            "evaluated_nodes": evaluated_nodes,
+                            "cached": True})
+        schedule_ponder(ws, func, data)
+        return
+
+    if waiting_tasks >= settings.reject_queue_length:
+        await ws.send_json({"status": "rejected",
+                            "retry_after": retry_after()})
+
+        print("Rejected!")
+        return
+
+    degraded = None
+    if overloaded():
+        data, degraded = degrade(data)
+        if degraded is not None:
+            key = result_cache_key(data)
+            args = (data,)
+            if key in result_cache:
+                result_cache.move_to_end(key)
+                evaluations, evaluated_nodes = result_cache[key]
+                await ws.send_json({"status": "complete",
+                                    "evaluations": evaluations,
+                                    "evaluated_nodes": evaluated_nodes,
+                                    "cached": True,
+                                    "degraded": degraded})
+                return
+
+    waiting_tasks += 1
+    try:
+        while not curr_workers < settings.worker_limit:
+            if ponder_tasks:
+                # preempt speculative work instead of making a client
+                # wait
+                ponder_tasks.pop(next(iter(ponder_tasks))).cancel()
+            else:
+                await ws.send_json({"status": "waiting"})
+            await curr_workers_change.wait()
+    finally:
+        waiting_tasks -= 1
 
     curr_workers_change.clear()
     curr_workers += 1
 
+    task_func = func
+    if profiled_tasks:
+        profiled_tasks -= 1
+        args = (settings.profile_dir, settings.profile_interval,
+                func, *args)
+        task_func = profiler.profile
+
     pool = Pool(1)
     loop = get_event_loop()
     future = loop.create_future()
 
     def future_set_result(result):
         future.set_result(result)
-    pool.apply_async(func, args, callback=future_set_result)
+    pool.apply_async(task_func, args, callback=future_set_result)
     await ws.send_json({"status": "running"})
 
     try:
@@ -137,9 +538,17 @@ async def apply_async_task(ws, func, *args):
         pool.close()
         curr_workers -= 1
         curr_workers_change.set()
-        await ws.send_json({"status": "complete",
-                            "evaluations": result[0],
-                            "evaluated_nodes": result[1]})
+        observe_latency(default_timer() - start_time)
+        response = {"status": "complete",
+                    "evaluations": result[0],
+                    "evaluated_nodes": result[1]}
+        if result[2] is not None:
+            response["stats"] = result[2]
+        if degraded is not None:
+            response["degraded"] = degraded
+        await ws.send_json(response)
+        store_result(key, result)
+        schedule_ponder(ws, func, data)
 
         print(f"Finished: {result}")
 
@@ -155,12 +564,85 @@ async def apply_async_task(ws, func, *args):
         pool.terminate()
         curr_workers -= 1
         curr_workers_change.set()
+        observe_latency(default_timer() - start_time)
         await ws.send_json({"status": "timeout"})
 
         print("Timeout!")
         raise
 
 
+async def debounce_task(ws, func, *args):
+    # Every new message cancels the task of the previous one, so a
+    # message replaced within ws_debounce_window is dropped here,
+    # before it takes a worker or spawns a pool. Only the latest message
+    # of a burst gets evaluated.
+    if result_cache_key(args[0]) not in result_cache:
+        await sleep(settings.ws_debounce_window)
+    await apply_async_task(ws, func, *args)
+
+
+async def run_batch_job(job: dict, func, messages: list):
+    global curr_workers
+
+    while not curr_workers < settings.worker_limit:
+        if ponder_tasks:
+            # speculative work is preempted for batch jobs as well
+            ponder_tasks.pop(next(iter(ponder_tasks))).cancel()
+        await curr_workers_change.wait()
+
+    curr_workers_change.clear()
+    curr_workers += 1
+
+    # all positions go to the same single worker process, so its
+    # caches carry over from one position to the next
+    pool = Pool(1)
+    loop = get_event_loop()
+    futures = []
+    for message in messages:
+        future = loop.create_future()
+
+        def future_set_result(result, future=future):
+            loop.call_soon_threadsafe(future.set_result, result)
+
+        def future_set_exception(error, future=future):
+            loop.call_soon_threadsafe(future.set_exception, error)
+        pool.apply_async(func, (message,), callback=future_set_result,
+                         error_callback=future_set_exception)
+        futures.append(future)
+    job["status"] = "running"
+
+    try:
+        for message, future in zip(messages, futures):
+            result = await wait_for(
+                future, timeout=settings.task_timeout)
+            job_result = {"board": message["board"],
+                          "evaluations": result[0],
+                          "evaluated_nodes": result[1]}
+            if result[2] is not None:
+                job_result["stats"] = result[2]
+            job["results"].append(job_result)
+
+        pool.close()
+        curr_workers -= 1
+        curr_workers_change.set()
+        job["status"] = "complete"
+
+    except TimeoutError:
+        pool.terminate()
+        curr_workers -= 1
+        curr_workers_change.set()
+        job["status"] = "timeout"
+
+    except Exception as error:
+        # a position failed in the worker, the job fails with it
+        # instead of waiting for task_timeout
+        pool.terminate()
+        curr_workers -= 1
+        curr_workers_change.set()
+        job["status"] = "error"
+        job["detail"] = repr(error)
+
+
 @app.get("/heuristic_function_tic_tac_toe/{board}")
 async def heuristic_function_tic_tac_toe(
     board: str = Depends(validate_tic_tac_toe_board),
@@ -178,11 +660,92 @@ async def heuristic_function_connect_four(
     return {"estimation": h}
 
 
+@app.get("/heuristic_function_mnk/{board}")
+async def heuristic_function_mnk(
+    board: tuple = Depends(validate_mnk_board),
+):
+    board, m, n, k = board
+    mnk.set_geometry(m, n, k)
+    x_tokens, o_tokens = encode_mnk_board(board)
+    _, h = mnk.heuristic(x_tokens, o_tokens, 0)
+    return {"estimation": h}
+
+
+@app.post("/batch_analysis")
+async def batch_analysis(
+    messages: list = Depends(validate_batch_analysis),
+):
+    if messages[0]["type"] == "tic_tac_toe":
+        func = evaluate_tic_tac_toe
+    elif messages[0].get("algorithm", "minimax") == "mcts":
+        func = evaluate_connect_four_mcts
+    elif messages[0]["type"] == "connect_four":
+        func = evaluate_connect_four
+    else:
+        func = evaluate_mnk
+    job_id = uuid4().hex
+    job = {"status": "waiting", "positions": len(messages),
+           "results": []}
+    batch_jobs[job_id] = job
+    while len(batch_jobs) > settings.batch_job_limit:
+        batch_jobs.popitem(last=False)
+    get_event_loop().create_task(run_batch_job(job, func, messages))
+    return {"job_id": job_id}
+
+
+@app.get("/batch_analysis/{job_id}")
+async def batch_analysis_status(
+    job_id: str,
+    since: int = 0,
+):
+    if job_id not in batch_jobs:
+        raise HTTPException(
+            status_code=404,
+            detail="job_id not found")
+    job = batch_jobs[job_id]
+    response = {"status": job["status"],
+                "positions": job["positions"],
+                "since": since,
+                "results": job["results"][since:]}
+    if "detail" in job:
+        response["detail"] = job["detail"]
+    return response
+
+
+@app.post("/admin/profile")
+async def admin_start_profile(
+    tasks: int = 1,
+    _: None = Depends(validate_admin_token),
+):
+    global profiled_tasks
+    if tasks < 0:
+        raise HTTPException(
+            status_code=400,
+            detail="tasks can't be smaller than 0")
+    profiled_tasks = tasks
+    return {"profiled_tasks": profiled_tasks}
+
+
+@app.get("/admin/profile")
+async def admin_list_profiles(
+    _: None = Depends(validate_admin_token),
+):
+    profiles = []
+    if path.isdir(settings.profile_dir):
+        profiles = sorted(listdir(settings.profile_dir))
+    return {"profiled_tasks": profiled_tasks,
+            "profile_dir": settings.profile_dir,
+            "profiles": profiles}
+
+
 @app.websocket("/ws")
 async def ws_endpoint(
     ws: WebSocket,
 ):
     curr_task = None
+    curr_data = None
+    cancel_window_start = 0
+    cancel_count = 0
     global curr_ws_connections
     loop = get_event_loop()
 
@@ -200,28 +763,64 @@ async def ws_endpoint(
             message = await ws.receive_text()
             data = loads(message)
 
+            # a re-sent request joins the task already evaluating it
+            # instead of restarting it, cancels are never coalesced and
+            # don't replace the request they cancel
+            if data["type"] != "cancel_task":
+                if data == curr_data and curr_task is not None \
+                        and not curr_task.done():
+                    continue
+                curr_data = data
+
             if data["type"] == "tic_tac_toe":
                 if curr_task is not None:
                     curr_task.cancel()
                 curr_task = loop.create_task(
-                    apply_async_task(
+                    debounce_task(
                         ws, evaluate_tic_tac_toe, data))
 
             elif data["type"] == "connect_four":
                 if curr_task is not None:
                     curr_task.cancel()
-                curr_task = loop.create_task(
-                    apply_async_task(
-                        ws, evaluate_connect_four, data))
+                if data.get("algorithm", "minimax") == "mcts":
+                    curr_task = loop.create_task(
+                        debounce_task(
+                            ws, evaluate_connect_four_mcts, data))
+                else:
+                    curr_task = loop.create_task(
+                        debounce_task(
+                            ws, evaluate_connect_four, data))
 
-            elif data["type"] == "cancel_task":
+            elif data["type"] == "mnk":
                 if curr_task is not None:
                     curr_task.cancel()
-                    curr_task = None
+                curr_task = loop.create_task(
+                    debounce_task(
+                        ws, evaluate_mnk, data))
+
+            elif data["type"] == "cancel_task":
+                if curr_task is None or curr_task.done():
+                    continue
+                # at most ws_cancel_limit running tasks are cancelled per
+                # second, past that the task keeps running, and a
+                # re-sent identical request joins it instead of
+                # spawning a new pool
+                if loop.time() - cancel_window_start >= 1:
+                    cancel_window_start = loop.time()
+                    cancel_count = 0
+                if not cancel_count < settings.ws_cancel_limit:
+                    await ws.send_json({"status": "throttled"})
+                    continue
+                cancel_count += 1
+                curr_task.cancel()
+                curr_task = None
+                curr_data = None
 
     except WebSocketDisconnect:
         if curr_task is not None:
             curr_task.cancel()
+        if id(ws) in ponder_tasks:
+            ponder_tasks.pop(id(ws)).cancel()
         curr_ws_connections -= 1
         print(f"Number of connections: {curr_ws_connections}")
 
@@ -241,67 +840,82 @@ def evaluate_tic_tac_toe(data):
     evaluations = []
     evaluated_nodes = 0
 
-    if not alpha_beta_pruning and not depth_limit:
-        if x_count == o_count:
-            for s in tic_tac_toe.successor(board, True):
-                res_eval, res_nodes = tic_tac_toe.minimax(s, False)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for s in tic_tac_toe.successor(board, False):
-                res_eval, res_nodes = tic_tac_toe.minimax(s, True)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-
-    if alpha_beta_pruning and not depth_limit:
-        if x_count == o_count:
-            for s in tic_tac_toe.successor(board, True):
-                res_eval, res_nodes = tic_tac_toe.minimax_alpha_beta(
-                    s, False, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for s in tic_tac_toe.successor(board, False):
-                res_eval, res_nodes = tic_tac_toe.minimax_alpha_beta(
-                    s, True, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-
-    if not alpha_beta_pruning and depth_limit:
-        if x_count == o_count:
-            for s in tic_tac_toe.successor(board, True):
-                res_eval, res_nodes = \
-                    tic_tac_toe.depth_limited_minimax(
-                        s, depth_limit_value - 1, False)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for s in tic_tac_toe.successor(board, False):
-                res_eval, res_nodes = \
-                    tic_tac_toe.depth_limited_minimax(
-                        s, depth_limit_value - 1, True)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-
-    if alpha_beta_pruning and depth_limit:
-        if x_count == o_count:
-            for s in tic_tac_toe.successor(board, True):
-                res_eval, res_nodes = \
-                    tic_tac_toe.depth_limited_minimax_alpha_beta(
-                        s, depth_limit_value - 1, False, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for s in tic_tac_toe.successor(board, False):
-                res_eval, res_nodes = \
-                    tic_tac_toe.depth_limited_minimax_alpha_beta(
-                        s, depth_limit_value - 1, True, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
+    stats = None
+    if data.get("stats", False):
+        stats = SearchStats(
+            tic_tac_toe, ("heuristic", "utility", "is_final_state"),
+            tic_tac_toe_ply)
+        stats.start()
+
+    try:
+        if not alpha_beta_pruning and not depth_limit:
+            if x_count == o_count:
+                for s in tic_tac_toe.successor(board, True):
+                    res_eval, res_nodes = tic_tac_toe.minimax(s, False)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for s in tic_tac_toe.successor(board, False):
+                    res_eval, res_nodes = tic_tac_toe.minimax(s, True)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if alpha_beta_pruning and not depth_limit:
+            if x_count == o_count:
+                for res_eval, res_nodes in root_search.game_values(
+                        lambda s, alpha, beta: tic_tac_toe.minimax_alpha_beta(
+                            s, False, alpha, beta),
+                        tic_tac_toe.successor(board, True)):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for res_eval, res_nodes in root_search.game_values(
+                        lambda s, alpha, beta: tic_tac_toe.minimax_alpha_beta(
+                            s, True, alpha, beta),
+                        tic_tac_toe.successor(board, False)):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if not alpha_beta_pruning and depth_limit:
+            if x_count == o_count:
+                for s in tic_tac_toe.successor(board, True):
+                    res_eval, res_nodes = \
+                        tic_tac_toe.depth_limited_minimax(
+                            s, depth_limit_value - 1, False)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for s in tic_tac_toe.successor(board, False):
+                    res_eval, res_nodes = \
+                        tic_tac_toe.depth_limited_minimax(
+                            s, depth_limit_value - 1, True)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if alpha_beta_pruning and depth_limit:
+            if x_count == o_count:
+                for s in tic_tac_toe.successor(board, True):
+                    res_eval, res_nodes = \
+                        tic_tac_toe.depth_limited_minimax_alpha_beta(
+                            s, depth_limit_value - 1, False, -inf, inf)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for s in tic_tac_toe.successor(board, False):
+                    res_eval, res_nodes = \
+                        tic_tac_toe.depth_limited_minimax_alpha_beta(
+                            s, depth_limit_value - 1, True, -inf, inf)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+    finally:
+        if stats is not None:
+            stats.stop()
 
     print(f"\nExecution time: {default_timer() - start_time:.7f}")
 
-    return evaluations, evaluated_nodes
+    return evaluations, evaluated_nodes, \
+        stats.moves if stats is not None else None
 
 
 def evaluate_connect_four(data):
@@ -321,74 +935,221 @@ def evaluate_connect_four(data):
     evaluations = []
     evaluated_nodes = 0
 
-    if not alpha_beta_pruning and not depth_limit:
-        if y_count == r_count:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = connect_four.minimax(
-                    yellow_tokens | move, token_mask | move, False)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = connect_four.minimax(
-                    yellow_tokens, token_mask | move, True)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-
-    if alpha_beta_pruning and not depth_limit:
-        if y_count == r_count:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = \
-                    connect_four.minimax_alpha_beta(
-                        yellow_tokens | move, token_mask | move,
-                        False, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = \
-                    connect_four.minimax_alpha_beta(
-                        yellow_tokens, token_mask | move,
-                        True, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-
-    if not alpha_beta_pruning and depth_limit:
-        if y_count == r_count:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = \
-                    connect_four.depth_limited_minimax(
-                        yellow_tokens | move, token_mask | move,
+    stats = None
+    if data.get("stats", False):
+        stats = SearchStats(
+            connect_four, ("heuristic", "utility"),
+            connect_four_ply)
+        stats.start()
+
+    try:
+        if not alpha_beta_pruning and not depth_limit:
+            if y_count == r_count:
+                for move in connect_four.possible_moves(token_mask):
+                    res_eval, res_nodes = connect_four.minimax(
+                        yellow_tokens | move, token_mask | move, False)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for move in connect_four.possible_moves(token_mask):
+                    res_eval, res_nodes = connect_four.minimax(
+                        yellow_tokens, token_mask | move, True)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if alpha_beta_pruning and not depth_limit:
+            if y_count == r_count:
+                for res_eval, res_nodes in root_search.game_values(
+                        lambda move, alpha, beta:
+                        connect_four.minimax_alpha_beta(
+                            yellow_tokens | move, token_mask | move,
+                            False, alpha, beta),
+                        connect_four.possible_moves(token_mask)):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for res_eval, res_nodes in root_search.game_values(
+                        lambda move, alpha, beta:
+                        connect_four.minimax_alpha_beta(
+                            yellow_tokens, token_mask | move,
+                            True, alpha, beta),
+                        connect_four.possible_moves(token_mask)):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if not alpha_beta_pruning and depth_limit:
+            if y_count == r_count:
+                for move in connect_four.possible_moves(token_mask):
+                    res_eval, res_nodes = \
+                        connect_four.depth_limited_minimax(
+                            yellow_tokens | move, token_mask | move,
+                            depth_limit_value - 1, False)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for move in connect_four.possible_moves(token_mask):
+                    res_eval, res_nodes = \
+                        connect_four.depth_limited_minimax(
+                            yellow_tokens, token_mask | move,
+                            depth_limit_value - 1, True)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if alpha_beta_pruning and depth_limit:
+            if y_count == r_count:
+                for res_eval, res_nodes in root_search.aspiration_values(
+                        lambda move, alpha, beta:
+                        connect_four.depth_limited_minimax_alpha_beta(
+                            yellow_tokens | move, token_mask | move,
+                            depth_limit_value - 1, False, alpha, beta),
+                        connect_four.possible_moves(token_mask),
+                        connect_four.aspiration_delta):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for res_eval, res_nodes in root_search.aspiration_values(
+                        lambda move, alpha, beta:
+                        connect_four.depth_limited_minimax_alpha_beta(
+                            yellow_tokens, token_mask | move,
+                            depth_limit_value - 1, True, alpha, beta),
+                        connect_four.possible_moves(token_mask),
+                        connect_four.aspiration_delta):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+    finally:
+        if stats is not None:
+            stats.stop()
+
+    print(f"\nExecution time: {default_timer() - start_time:.7f}")
+
+    return evaluations, evaluated_nodes, \
+        stats.moves if stats is not None else None
+
+
+def evaluate_connect_four_mcts(data):
+    start_time = default_timer()
+
+    board = validate_connect_four_board(data["board"])
+    time_limit, playout_limit = validate_mcts_budget(
+        data.get("time_limit"), data.get("playout_limit"))
+
+    yellow_tokens, token_mask = encode_connect_four_board(board)
+
+    y_count = bin(yellow_tokens).count("1")
+    r_count = bin(token_mask).count("1") - y_count
+
+    res_evals, playouts = mcts.mcts(
+        yellow_tokens, token_mask, y_count == r_count,
+        time_limit, playout_limit, settings.mcts_playout_batch)
+    evaluations = [float("{:.2f}".format(res_eval))
+                   for res_eval in res_evals]
+
+    print(f"\nExecution time: {default_timer() - start_time:.7f}")
+
+    return evaluations, playouts, None
+
+
+def evaluate_mnk(data):
+    start_time = default_timer()
+
+    board, m, n, k = validate_mnk_board(
+        data["board"], data["m"], data["n"], data["k"])
+    alpha_beta_pruning: bool = data["alpha_beta_pruning"]
+    depth_limit: bool = data["depth_limit"]
+    depth_limit_value = validate_depth_limit(
+        data["depth_limit"], data["depth_limit_value"])
+
+    mnk.set_geometry(m, n, k)
+    x_tokens, o_tokens = encode_mnk_board(board)
+
+    x_count = board.count('x')
+    o_count = board.count('o')
+
+    # evaluations are listed in board order, like tic-tac-toe
+    moves = [mnk.cell_bit(tile_index)
+             for tile_index, tile in enumerate(board) if tile == '_']
+
+    evaluations = []
+    evaluated_nodes = 0
+
+    stats = None
+    if data.get("stats", False):
+        stats = SearchStats(
+            mnk, ("heuristic", "utility"),
+            mnk_ply)
+        stats.start()
+
+    try:
+        if not alpha_beta_pruning and not depth_limit:
+            if x_count == o_count:
+                for move in moves:
+                    res_eval, res_nodes = mnk.minimax(
+                        x_tokens | move, o_tokens, False)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for move in moves:
+                    res_eval, res_nodes = mnk.minimax(
+                        x_tokens, o_tokens | move, True)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if alpha_beta_pruning and not depth_limit:
+            if x_count == o_count:
+                for res_eval, res_nodes in root_search.game_values(
+                        lambda move, alpha, beta: mnk.minimax_alpha_beta(
+                            x_tokens | move, o_tokens, False, alpha, beta),
+                        moves):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for res_eval, res_nodes in root_search.game_values(
+                        lambda move, alpha, beta: mnk.minimax_alpha_beta(
+                            x_tokens, o_tokens | move, True, alpha, beta),
+                        moves):
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if not alpha_beta_pruning and depth_limit:
+            if x_count == o_count:
+                for move in moves:
+                    res_eval, res_nodes = mnk.depth_limited_minimax(
+                        x_tokens | move, o_tokens,
                         depth_limit_value - 1, False)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = \
-                    connect_four.depth_limited_minimax(
-                        yellow_tokens, token_mask | move,
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for move in moves:
+                    res_eval, res_nodes = mnk.depth_limited_minimax(
+                        x_tokens, o_tokens | move,
                         depth_limit_value - 1, True)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-
-    if alpha_beta_pruning and depth_limit:
-        if y_count == r_count:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = \
-                    connect_four.depth_limited_minimax_alpha_beta(
-                        yellow_tokens | move, token_mask | move,
-                        depth_limit_value - 1, False, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
-        else:
-            for move in connect_four.possible_moves(token_mask):
-                res_eval, res_nodes = \
-                    connect_four.depth_limited_minimax_alpha_beta(
-                        yellow_tokens, token_mask | move,
-                        depth_limit_value - 1, True, -inf, inf)
-                evaluations.append(float("{:.2f}".format(res_eval)))
-                evaluated_nodes += res_nodes
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+        if alpha_beta_pruning and depth_limit:
+            if x_count == o_count:
+                for move in moves:
+                    res_eval, res_nodes = \
+                        mnk.depth_limited_minimax_alpha_beta(
+                            x_tokens | move, o_tokens,
+                            depth_limit_value - 1, False, -inf, inf)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+            else:
+                for move in moves:
+                    res_eval, res_nodes = \
+                        mnk.depth_limited_minimax_alpha_beta(
+                            x_tokens, o_tokens | move,
+                            depth_limit_value - 1, True, -inf, inf)
+                    evaluations.append(float("{:.2f}".format(res_eval)))
+                    evaluated_nodes += res_nodes
+
+    finally:
+        if stats is not None:
+            stats.stop()
 
     print(f"\nExecution time: {default_timer() - start_time:.7f}")
 
-    return evaluations, evaluated_nodes
+    return evaluations, evaluated_nodes, \
+        stats.moves if stats is not None else None
@@ -0,0 +1,278 @@
+from functools import cache
+from math import inf
+
+
+# geometry
+#
+# Cell (row, column) of an m x n board is stored at bit
+# row * (n + 1) + column. The extra, always empty, column n separates
+# the rows, so lines can't wrap around the board edge when shifting.
+
+board_rows = 0
+board_columns = 0
+line_length = 0
+board_mask = 0
+center = 0
+neighbor_shifts = ()
+line_shifts = ()
+window_shifts = ()
+counter_bits = 0
+window_weights = ()
+
+
+def set_geometry(m: int, n: int, k: int):
+    global board_rows, board_columns, line_length, board_mask, center, \
+        neighbor_shifts, line_shifts, window_shifts, counter_bits, \
+        window_weights
+    if (m, n, k) == (board_rows, board_columns, line_length):
+        return
+    board_rows, board_columns, line_length = m, n, k
+    stride = n + 1
+    board_mask = 0
+    for row in range(m):
+        board_mask |= ((1 << n) - 1) << row * stride
+    center = 1 << (m // 2 * stride + n // 2)
+    neighbor_shifts = (1, stride - 1, stride, stride + 1)
+    # horizontal, vertical, diagonal and anti-diagonal shifts, split
+    # into doubling steps so a line of k needs O(log k) operations
+    line_shifts = []
+    for shift in (1, stride, stride + 1, stride - 1):
+        shifts = []
+        length = 1
+        while length * 2 <= k:
+            shifts.append(shift * length)
+            length *= 2
+        if length < k:
+            shifts.append(shift * (k - length))
+        line_shifts.append(tuple(shifts))
+    line_shifts = tuple(line_shifts)
+    window_shifts = tuple(tuple(shift * index for index in range(k))
+                          for shift in (1, stride, stride + 1, stride - 1))
+    counter_bits = k.bit_length()
+    # a window holding c tokens of one player and none of the other
+    # is worth 4 ** (c - k + 1), so an open k - 1 is worth 1
+    window_weights = (0,) + tuple(4.0 ** (count - k + 1)
+                                  for count in range(1, k + 1))
+    minimax.cache_clear()
+    minimax_alpha_beta.cache_clear()
+    depth_limited_minimax.cache_clear()
+    depth_limited_minimax_alpha_beta.cache_clear()
+
+
+# minimax
+
+@cache
+def minimax(x_tokens: int, o_tokens: int, maximizer_turn: bool):
+    if maximizer_turn:
+        is_final_state, u = utility(o_tokens, x_tokens | o_tokens)
+        if is_final_state:
+            return -u, 1
+        v = -inf
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes = minimax(
+                x_tokens | move, o_tokens, False)
+            evaluated_nodes += res_nodes
+            v = max(v, res_eval)
+        return v, evaluated_nodes + 1
+    else:
+        is_final_state, u = utility(x_tokens, x_tokens | o_tokens)
+        if is_final_state:
+            return u, 1
+        v = inf
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes = minimax(
+                x_tokens, o_tokens | move, True)
+            evaluated_nodes += res_nodes
+            v = min(v, res_eval)
+        return v, evaluated_nodes + 1
+
+
+# minimax_alpha_beta
+
+@cache
+def minimax_alpha_beta(x_tokens: int, o_tokens: int,
+                       maximizer_turn: bool,
+                       alpha: int, beta: int):
+    if maximizer_turn:
+        is_final_state, u = utility(o_tokens, x_tokens | o_tokens)
+        if is_final_state:
+            return -u, 1
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes = minimax_alpha_beta(
+                x_tokens | move, o_tokens, False, alpha, beta)
+            evaluated_nodes += res_nodes
+            alpha = max(alpha, res_eval)
+            if alpha >= beta:
+                return alpha, evaluated_nodes + 1
+        return alpha, evaluated_nodes + 1
+    else:
+        is_final_state, u = utility(x_tokens, x_tokens | o_tokens)
+        if is_final_state:
+            return u, 1
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes = minimax_alpha_beta(
+                x_tokens, o_tokens | move, True, alpha, beta)
+            evaluated_nodes += res_nodes
+            beta = min(beta, res_eval)
+            if alpha >= beta:
+                return beta, evaluated_nodes + 1
+        return beta, evaluated_nodes + 1
+
+
+# depth_limited_minimax
+
+@cache
+def depth_limited_minimax(x_tokens: int, o_tokens: int, d: int,
+                          maximizer_turn: bool):
+    if maximizer_turn:
+        is_final_state, h = heuristic(o_tokens, x_tokens, d)
+        if d == 0 or is_final_state:
+            return -h, 1
+        v = -inf
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes = depth_limited_minimax(
+                x_tokens | move, o_tokens, d - 1, False)
+            evaluated_nodes += res_nodes
+            v = max(v, res_eval)
+        return v, evaluated_nodes + 1
+    else:
+        is_final_state, h = heuristic(x_tokens, o_tokens, d)
+        if d == 0 or is_final_state:
+            return h, 1
+        v = inf
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes = depth_limited_minimax(
+                x_tokens, o_tokens | move, d - 1, True)
+            evaluated_nodes += res_nodes
+            v = min(v, res_eval)
+        return v, evaluated_nodes + 1
+
+
+# depth_limited_minimax_alpha_beta
+
+@cache
+def depth_limited_minimax_alpha_beta(x_tokens: int, o_tokens: int,
+                                     d: int, maximizer_turn: bool,
+                                     alpha: int, beta: int):
+    if maximizer_turn:
+        is_final_state, h = heuristic(o_tokens, x_tokens, d)
+        if d == 0 or is_final_state:
+            return -h, 1
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes \
+                = depth_limited_minimax_alpha_beta(
+                    x_tokens | move, o_tokens,
+                    d - 1, False, alpha, beta)
+            evaluated_nodes += res_nodes
+            alpha = max(alpha, res_eval)
+            if alpha >= beta:
+                return alpha, evaluated_nodes + 1
+        return alpha, evaluated_nodes + 1
+    else:
+        is_final_state, h = heuristic(x_tokens, o_tokens, d)
+        if d == 0 or is_final_state:
+            return h, 1
+        evaluated_nodes = 0
+        for move in possible_moves(x_tokens | o_tokens):
+            res_eval, res_nodes \
+                = depth_limited_minimax_alpha_beta(
+                    x_tokens, o_tokens | move,
+                    d - 1, True, alpha, beta)
+            evaluated_nodes += res_nodes
+            beta = min(beta, res_eval)
+            if alpha >= beta:
+                return beta, evaluated_nodes + 1
+        return beta, evaluated_nodes + 1
+
+
+def has_line(tokens: int):
+    for shifts in line_shifts:
+        pattern_mask = tokens
+        for shift in shifts:
+            pattern_mask &= pattern_mask >> shift
+        if pattern_mask:
+            return True
+    return False
+
+
+def heuristic(tokens: int, opponent_tokens: int, d: int):
+    if has_line(tokens):
+        return True, 1
+    if tokens | opponent_tokens == board_mask:
+        return True, 0
+    if d != 0:
+        return False, None
+    h = count_windows(tokens, board_mask & ~opponent_tokens) \
+        - count_windows(opponent_tokens, board_mask & ~tokens)
+    # squash into (-1, 1) so a heuristic never outweighs a win
+    return False, h / (1 + abs(h))
+
+
+def count_windows(tokens: int, free_cells: int):
+    # Windows are identified by their first cell and counted for all
+    # cells at once: open_windows marks windows without opponent
+    # tokens, and a bit-sliced counter (one int per bit of the count)
+    # holds the number of tokens in every window.
+    h = 0
+    for shifts in window_shifts:
+        open_windows = free_cells
+        for shift in shifts:
+            open_windows &= free_cells >> shift
+        if not open_windows:
+            continue
+        counter = [0] * counter_bits
+        for shift in shifts:
+            carry = (tokens >> shift) & open_windows
+            for bit in range(counter_bits):
+                if not carry:
+                    break
+                counter[bit], carry = counter[bit] ^ carry, \
+                    counter[bit] & carry
+        for count in range(1, line_length):
+            pattern_mask = open_windows
+            for bit in range(counter_bits):
+                if count >> bit & 1:
+                    pattern_mask &= counter[bit]
+                else:
+                    pattern_mask &= ~counter[bit]
+            if pattern_mask:
+                h += window_weights[count] * bin(pattern_mask).count('1')
+    return h
+
+
+def utility(tokens: int, token_mask: int):
+    if has_line(tokens):
+        return True, 1
+    if token_mask == board_mask:
+        return True, 0
+    return False, None
+
+
+def possible_moves(token_mask: int):
+    # moves next to existing tokens first, they are the ones most
+    # likely to cause cutoffs
+    empty_cells = board_mask & ~token_mask
+    if token_mask:
+        neighbors = token_mask
+        for shift in neighbor_shifts:
+            neighbors |= (token_mask << shift) | (token_mask >> shift)
+        neighbors &= empty_cells
+    else:
+        neighbors = center & empty_cells
+    for cells in (neighbors, empty_cells & ~neighbors):
+        while cells:
+            move = cells & -cells
+            yield move
+            cells ^= move
+
+
+def cell_bit(index: int):
+    return 1 << (index // board_columns * (board_columns + 1)
+                 + index % board_columns)
@@ -0,0 +1,56 @@
+from collections import Counter
+from os import getpid, makedirs, path
+from sys import _current_frames
+from threading import Event, Thread, get_ident
+from time import strftime
+from timeit import default_timer
+
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} "
+                     f"({path.basename(code.co_filename)}"
+                     f":{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def dump(samples: Counter, file_name: str):
+    with open(file_name, "w") as file:
+        for stack, count in samples.most_common():
+            file.write(f"{stack} {count}\n")
+
+
+def sample(thread_id: int, interval: float, file_name: str,
+           stopped: Event):
+    samples = Counter()
+    last_dump = default_timer()
+    while not stopped.wait(interval):
+        frame = _current_frames().get(thread_id)
+        if frame is not None:
+            samples[collapse_stack(frame)] += 1
+        # dump periodically, a task that times out is terminated
+        # before it gets the chance to dump its samples at the end
+        if default_timer() - last_dump > 1:
+            dump(samples, file_name)
+            last_dump = default_timer()
+    dump(samples, file_name)
+
+
+def profile(profile_dir: str, interval: float, func, *args):
+    makedirs(profile_dir, exist_ok=True)
+    file_name = path.join(
+        profile_dir,
+        f"{func.__name__}_{strftime('%Y%m%d_%H%M%S')}_{getpid()}.txt")
+    stopped = Event()
+    sampler = Thread(target=sample,
+                     args=(get_ident(), interval, file_name, stopped),
+                     daemon=True)
+    sampler.start()
+    try:
+        return func(*args)
+    finally:
+        stopped.set()
+        sampler.join()
@@ -0,0 +1,44 @@
+from math import inf
+
+
+# Root drivers for alpha-beta search. Every root move needs an exact
+# evaluation, so the root itself can't prune, but all root moves are
+# searched with the same window: siblings then share the @cache and
+# transposition table entries of the positions they have in common, and
+# the narrow window prunes more below them. search(child, alpha, beta)
+# returns the fail-hard (value, evaluated_nodes) of a root move.
+
+
+def game_values(search, children):
+    # Without a depth limit a value is a win, a draw or a loss (1, 0 or
+    # -1), which a single search in (-0.5, 0.5) tells apart exactly.
+    for child in children:
+        value, nodes = search(child, -0.5, 0.5)
+        if value <= -0.5:
+            value = -1
+        elif value >= 0.5:
+            value = 1
+        else:
+            value = 0
+        yield value, nodes
+
+
+def aspiration_values(search, children, delta: float):
+    # The first root move gets a full window, the others an aspiration
+    # window of +-delta around its value. Only the moves failing low or
+    # high are searched again, with the window open on that side.
+    window = None
+    for child in children:
+        if window is None:
+            value, nodes = search(child, -inf, inf)
+            window = value - delta, value + delta
+        else:
+            alpha, beta = window
+            value, nodes = search(child, alpha, beta)
+            if value <= alpha:
+                value, research_nodes = search(child, -inf, alpha)
+                nodes += research_nodes
+            elif value >= beta:
+                value, research_nodes = search(child, beta, inf)
+                nodes += research_nodes
+        yield value, nodes
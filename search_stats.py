@@ -0,0 +1,156 @@
+from functools import cache
+from time import perf_counter
+
+
+search_functions = ("minimax", "minimax_alpha_beta",
+                    "depth_limited_minimax",
+                    "depth_limited_minimax_alpha_beta")
+
+
+def tic_tac_toe_ply(args: tuple):
+    return 9 - args[0].count('_')
+
+
+def connect_four_ply(args: tuple):
+    return bin(args[1]).count("1")
+
+
+def mnk_ply(args: tuple):
+    return bin(args[0] | args[1]).count("1")
+
+
+class SearchStats:
+    """Collects per-root-move search statistics.
+
+    While started, the search and evaluation functions of a game module
+    are replaced with instrumented copies. Recursive calls go through
+    the module globals, so every node of the search passes through the
+    instrumentation, while the original functions stay untouched and
+    pay nothing when statistics are not requested.
+    """
+
+    def __init__(self, module, evaluation_functions: tuple, ply):
+        self.module = module
+        self.transposition_table = getattr(
+            module, "transposition_table", None)
+        if self.transposition_table is not None \
+                and self.transposition_table.words is None:
+            # disabled, no hits to report
+            self.transposition_table = None
+        self.evaluation_functions = evaluation_functions
+        self.ply = ply
+        self.originals = {}
+        self.stack = []
+        self.moves = []
+        self.reset()
+
+    def reset(self):
+        self.nodes_per_depth = []
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.cache_hits = 0
+        self.expansions = 0
+        self.heuristic_time = 0
+        self.start_time = None
+        self.root_ply = None
+        self.tt_hits = None
+        self.root_args = None
+
+    def start(self):
+        for name in search_functions + self.evaluation_functions:
+            self.originals[name] = getattr(self.module, name)
+        for name in search_functions:
+            setattr(self.module, name, self.instrument_search(
+                self.originals[name].__wrapped__,
+                name.endswith("alpha_beta")))
+        for name in self.evaluation_functions:
+            setattr(self.module, name, self.instrument_evaluation(
+                self.originals[name]))
+
+    def stop(self):
+        for name, func in self.originals.items():
+            setattr(self.module, name, func)
+        self.originals = {}
+
+    def instrument_search(self, func, alpha_beta: bool):
+        stack = self.stack
+
+        @cache
+        def expand(*args):
+            self.expansions += 1
+            depth = self.ply(args) - self.root_ply
+            while len(self.nodes_per_depth) <= depth:
+                self.nodes_per_depth.append(0)
+            self.nodes_per_depth[depth] += 1
+            stack.append(0)
+            result = func(*args)
+            children = stack.pop()
+            if alpha_beta and children:
+                # args end with (maximizer_turn, alpha, beta)
+                if args[-3]:
+                    cutoff = result[0] >= args[-1]
+                else:
+                    cutoff = result[0] <= args[-2]
+                if cutoff:
+                    self.cutoffs += 1
+                    if children == 1:
+                        self.first_move_cutoffs += 1
+            return result
+
+        def search(*args):
+            if stack:
+                stack[-1] += 1
+            elif alpha_beta and args[:-2] == self.root_args:
+                # the same root move searched again with another window,
+                # both searches count towards its record
+                self.moves.pop()
+            else:
+                self.reset()
+                if alpha_beta:
+                    self.root_args = args[:-2]
+                self.start_time = perf_counter()
+                self.root_ply = self.ply(args)
+                if self.transposition_table is not None:
+                    self.tt_hits = self.transposition_table.hits
+            expansions = self.expansions
+            result = expand(*args)
+            if self.expansions == expansions:
+                self.cache_hits += 1
+            if not stack:
+                self.moves.append(self.record())
+            return result
+
+        return search
+
+    def instrument_evaluation(self, func):
+        def evaluate(*args):
+            start_time = perf_counter()
+            result = func(*args)
+            self.heuristic_time += perf_counter() - start_time
+            return result
+
+        return evaluate
+
+    def record(self):
+        elapsed_time = perf_counter() - self.start_time
+        nodes = sum(self.nodes_per_depth)
+        max_depth = len(self.nodes_per_depth) - 1
+        effective_branching_factor = \
+            nodes ** (1 / max_depth) if max_depth > 0 else 0
+        first_move_cutoff_rate = \
+            round(self.first_move_cutoffs / self.cutoffs, 3) \
+            if self.cutoffs else None
+        tt_hits = None
+        if self.transposition_table is not None:
+            tt_hits = self.transposition_table.hits - self.tt_hits
+        return {
+            "nodes_per_depth": self.nodes_per_depth,
+            "cutoffs": self.cutoffs,
+            "first_move_cutoff_rate": first_move_cutoff_rate,
+            "cache_hits": self.cache_hits,
+            "tt_hits": tt_hits,
+            "effective_branching_factor": round(
+                effective_branching_factor, 3),
+            "heuristic_time": round(self.heuristic_time, 7),
+            "search_time": round(elapsed_time - self.heuristic_time, 7),
+        }